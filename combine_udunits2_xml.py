@@ -1,17 +1,31 @@
 # Copyright (c) 2019 University Corporation for Atmospheric Research/Unidata
 # Distributed under the terms of the BSD 3-Clause License.
+import asyncio
+import functools
 import getpass
 import io
 import json
 import logging
 import os
+import re
+import shutil
 import sys
 import urllib.parse
-import xml.etree.ElementTree as ET
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+import aiohttp
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    from lxml import etree as ET
+    using_lxml = True
+except ImportError:
+    import xml.etree.ElementTree as ET
+    using_lxml = False
 
 root = logging.getLogger()
 root.setLevel(logging.DEBUG)
@@ -22,16 +36,89 @@ root.addHandler(handler)
 
 # nexus urls
 nexus_url = 'https://artifacts.unidata.ucar.edu/'
+nexus_asset_search_url = urllib.parse.urljoin(nexus_url, '/service/rest/v1/search/assets')
 nexus_asset_search_and_download_url = urllib.parse.urljoin(nexus_url, '/service/rest/v1/search/assets/download/')
 nexus_components_url = urllib.parse.urljoin(nexus_url, '/service/rest/v1/components/')
 nexus_search_url = urllib.parse.urljoin(nexus_url, '/service/rest/v1/search/')
 repository_name = 'docs-thredds-udunits'
 
+# public url of the current combined xml file
+current_combined_xml_url = 'https://docs.unidata.ucar.edu/thredds/udunits2/current/udunits2_combined.xml'
+
+# shared http session, so connections to the same host (github, nexus) are
+# kept alive and reused across requests. Requests that are rate limited or hit
+# a server error are retried with backoff. Retrying uploads and deletes is
+# safe even if the server already applied them: raw uploads overwrite the
+# existing assets, and deletes treat a 404 as success.
+SESSION = requests.Session()
+SESSION.mount('https://', HTTPAdapter(pool_connections=4,
+                                      pool_maxsize=8,
+                                      max_retries=Retry(total=5,
+                                                        backoff_factor=0.3,
+                                                        status_forcelist=(429, 500, 502, 503, 504),
+                                                        allowed_methods=frozenset(['GET', 'HEAD', 'POST', 'DELETE']))))
+
+# maximum number of concurrent requests made when fetching with aiohttp
+max_concurrent_fetches = 4
+
 # file names (on-disk and in nexus)
 copyright_file_name = 'UDUNITS-2_COPYRIGHT'
 combined_xml_file_name = 'udunits2_combined.xml'
 
+# year used in the copyright text of the combined xml file
+copyright_year = datetime.today().year
+
+# local cache of http validators (e.g. ETag), so unchanged resources are not
+# downloaded again on every run
+cache_dir = os.path.join(os.path.expanduser('~'), '.cache', 'udunits2_xml')
+github_release_cache_file_name = os.path.join(cache_dir, 'releases.etag')
+nexus_current_cache_file_name = os.path.join(cache_dir, 'nexus_current.json')
+
+
+def _load_cache(cache_filename):
+    r"""Load cached values from disk.
+
+    Parameters
+    ----------
+    cache_filename : string
+       filename of the json cache file
+
+    Returns
+    -------
+    dict
+        cached values, or an empty dict if the cache does not exist or cannot
+        be read
+
+    """
+    try:
+        with open(cache_filename, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
 
+def _save_cache(cache_filename, values):
+    r"""Save values to the cache on disk.
+
+    Failure to write the cache is logged, but otherwise ignored.
+
+    Parameters
+    ----------
+    cache_filename : string
+       filename of the json cache file
+    values : dict
+       values to cache
+
+    """
+    try:
+        os.makedirs(os.path.dirname(cache_filename), exist_ok=True)
+        with open(cache_filename, 'w') as f:
+            json.dump(values, f)
+    except OSError as e:
+        logging.debug('Unable to write cache file {}: {}'.format(cache_filename, e))
+
+
+@functools.lru_cache(maxsize=8)
 def get_udunits2_copyright_text(version):
     r"""Obtain copyright text to be used in the combined xml file.
 
@@ -45,7 +132,7 @@ def get_udunits2_copyright_text(version):
     combined_copyright = ('Copyright {} University Corporation for Atmospheric Research\n\n'
                           'This file is derived from the UDUNITS-2 package.  See the UDUNITS-2_COPYRIGHT\n'
                           'https://docs.unidata.ucar.edu/thredds/udunits2/{}/UDUNITS-2_COPYRIGHT for copying and\n'
-                          'redistribution conditions.\n').format(datetime.today().year, version)
+                          'redistribution conditions.\n').format(copyright_year, version)
 
     return combined_copyright
 
@@ -63,10 +150,11 @@ def fetch_udunits2_copyright_gh(version, save_filename):
     """
 
     cr_url = 'https://raw.githubusercontent.com/Unidata/UDUNITS-2/{}/COPYRIGHT'.format(version)
-    response = requests.get(cr_url)
-    response.raise_for_status()
-    with open(save_filename, 'wb') as f:
-        f.write(response.content)
+    with SESSION.get(cr_url, stream=True) as response:
+        response.raise_for_status()
+        response.raw.decode_content = True
+        with open(save_filename, 'wb') as f:
+            shutil.copyfileobj(response.raw, f, length=64 * 1024)
 
 
 def get_creds():
@@ -120,14 +208,43 @@ def get_latest_github_release_version():
     v2.2.27.6
 
     """
-    response = requests.get('https://github.com/Unidata/UDUNITS-2/releases.atom')
+    cache = _load_cache(github_release_cache_file_name)
+    headers = {}
+    if cache.get('etag') and cache.get('version'):
+        headers['If-None-Match'] = cache['etag']
+
+    response = SESSION.get('https://github.com/Unidata/UDUNITS-2/releases.atom', headers=headers)
+    if response.status_code == 304:
+        # release feed has not changed since the last run
+        udunits2_version = cache['version']
+        logging.info('Most recent UDUNITS-2 release version from github (cached): {}'.format(udunits2_version))
+        return udunits2_version
+
+    response.raise_for_status()
     release_info_xml = response.content
-    release_info = ET.fromstring(release_info_xml)
     entry_e = '{http://www.w3.org/2005/Atom}entry'
     title_e = '{http://www.w3.org/2005/Atom}title'
-    udunits2_version = release_info.find(entry_e).find(title_e).text
+    # the most recent release is the first entry in the feed, so stop parsing
+    # once we have its title (the feed itself also has a title, so make sure
+    # we are inside an entry)
+    udunits2_version = None
+    in_entry = False
+    for event, element in ET.iterparse(io.BytesIO(release_info_xml), events=('start', 'end')):
+        if event == 'start':
+            if element.tag == entry_e:
+                in_entry = True
+        elif in_entry and element.tag == title_e:
+            udunits2_version = element.text
+            break
+
+    if udunits2_version is None:
+        raise ValueError('Unable to find a release version in the UDUNITS-2 github releases feed.')
     logging.info('Most recent UDUNITS-2 release version from github: {}'.format(udunits2_version))
 
+    etag = response.headers.get('ETag')
+    if etag:
+        _save_cache(github_release_cache_file_name, {'etag': etag, 'version': udunits2_version})
+
     return udunits2_version
 
 
@@ -149,31 +266,39 @@ def publish_to_nexus(version, combined_xml_filename, copyright_filename):
     raw_directory_versioned = '/udunits2/{}/'.format(version)
     raw_directory_current = '/udunits2/current/'
 
+    # set credentials once on the shared session, rather than per request
+    SESSION.auth = (nexus_cred.name, nexus_cred.pw)
+
     params = (
         ('repository', repository_name),
     )
 
-    with open(combined_xml_filename, 'rb') as xmlfile, open(copyright_filename, 'rb') as cr_file:
-        logging.info('Publish versioned files.')
+    # read the files once, and upload from memory
+    with open(combined_xml_filename, 'rb') as xmlfile:
+        xml_bytes = xmlfile.read()
+    with open(copyright_filename, 'rb') as cr_file:
+        cr_bytes = cr_file.read()
+
+    def publish(raw_directory):
+        # each upload gets its own file objects, so uploads can run concurrently
         files = {
-            'raw.directory': (None, raw_directory_versioned),
-            'raw.asset1': (combined_xml_filename, xmlfile),
+            'raw.directory': (None, raw_directory),
+            'raw.asset1': (combined_xml_filename, io.BytesIO(xml_bytes)),
             'raw.asset1.filename': (None, combined_xml_filename),
-            'raw.asset2': (copyright_filename, cr_file),
+            'raw.asset2': (copyright_filename, io.BytesIO(cr_bytes)),
             'raw.asset2.filename': (None, copyright_filename),
         }
 
         # make post.
-        response = requests.post(nexus_components_url,
-                                 params=params,
-                                 files=files,
-                                 auth=(nexus_cred.name, nexus_cred.pw))
+        response = SESSION.post(nexus_components_url,
+                                params=params,
+                                files=files)
 
         # if unsuccessful, raise an error
         response.raise_for_status()
-        logging.info('...success.')
+        logging.info('...published files to {}.'.format(raw_directory))
 
-        # clear out "current" directory in nexus
+    def find_current_items():
         search_params = {
             'repository': repository_name,
             'group': raw_directory_current.rstrip('/'),
@@ -181,42 +306,113 @@ def publish_to_nexus(version, combined_xml_filename, copyright_filename):
 
         # have to use search to get everything under "/udunits2/current",
         # then remove items one-by-one
-        search_response = requests.get(nexus_search_url,
-                                       params=search_params)
+        search_response = SESSION.get(nexus_search_url,
+                                      params=search_params)
         search_response.raise_for_status()
 
         results = json.loads(search_response.content)
-        items = results.get('items')
-        if items:
-            logging.info('Clean out "current" files.')
-
-            for item in items:
-                item_id = item.get('id')
-                if item_id:
-                    asset_url = urllib.parse.urljoin(nexus_components_url, item_id)
-                    delete_response = requests.delete(asset_url, auth=(nexus_cred.name, nexus_cred.pw))
-                    delete_response.raise_for_status()
-                    logging.debug('...removed {}.'.format(item.get('name')))
-            logging.info('...success.')
-
-        # before updating the current version, need to go back to the
-        # beginning of the files, otherwise empty file will appear in
-        # nexus
-        xmlfile.seek(0)
-        cr_file.seek(0)
-
-        logging.info('Update "current" files.')
-        files['raw.directory'] = (None, raw_directory_current)
-
-        response = requests.post(nexus_components_url,
-                                 params=params,
-                                 files=files,
-                                 auth=(nexus_cred.name, nexus_cred.pw))
-
-        # if unsuccessful, raise an error
-        response.raise_for_status()
+        return results.get('items')
+
+    # "current" must only be touched once the versioned upload has succeeded,
+    # otherwise a failed run would leave "current" pointing at a version that
+    # was never published. The search for the "current" items is read-only, so
+    # it can run alongside the versioned upload.
+    logging.info('Publish versioned files.')
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        versioned_future = executor.submit(publish, raw_directory_versioned)
+        items = find_current_items()
+        versioned_future.result()
+    logging.info('...success.')
+
+    # clear out "current" directory in nexus
+    if items:
+        logging.info('Clean out "current" files.')
+
+        def delete_item(item):
+            asset_url = '{}{}'.format(nexus_components_url, item.get('id'))
+            delete_response = SESSION.delete(asset_url)
+            # a retried delete gets a 404 if an earlier attempt removed
+            # the component, which is what we want anyway
+            if delete_response.status_code == 404:
+                logging.debug('...{} already removed.'.format(item.get('name')))
+                return
+            delete_response.raise_for_status()
+            logging.debug('...removed {}.'.format(item.get('name')))
+
+        # deletes are independent of each other, so run them concurrently
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(delete_item, [item for item in items if item.get('id')]))
         logging.info('...success.')
 
+    logging.info('Update "current" files.')
+    publish(raw_directory_current)
+    logging.info('...success.')
+
+
+def get_nexus_current_checksum():
+    r"""Find the checksum of the current combined xml on nexus.
+
+    Uses the nexus asset search api (json metadata only), limited to the
+    "current" directory. The combined xml file itself is not downloaded.
+
+    Returns
+    -------
+    string or None
+        sha1 checksum of the current combined xml, or None if it is not in
+        the search results
+
+    """
+    search_params = {
+        'repository': repository_name,
+        'group': '/udunits2/current',
+    }
+
+    search_response = SESSION.get(nexus_asset_search_url, params=search_params)
+    search_response.raise_for_status()
+
+    current_path = 'udunits2/current/{}'.format(combined_xml_file_name)
+    for asset in search_response.json().get('items') or []:
+        if asset.get('path', '').lstrip('/') == current_path:
+            return (asset.get('checksum') or {}).get('sha1')
+
+    return None
+
+
+def get_nexus_version_from_checksum(checksum):
+    r"""Find the version of udunits-2 of the versioned combined xml with a given checksum.
+
+    Uses the nexus asset search api to find the assets with the given checksum,
+    and extracts the version from the path of the versioned combined xml.
+
+    Parameters
+    ----------
+    checksum : string
+       sha1 checksum of the combined xml
+
+    Returns
+    -------
+    string or None
+        version of udunits-2 as a dot separated set of integers, or None if
+        no versioned combined xml has the given checksum
+
+    """
+    search_params = {
+        'repository': repository_name,
+        'sha1': checksum,
+    }
+
+    search_response = SESSION.get(nexus_asset_search_url, params=search_params)
+    search_response.raise_for_status()
+
+    # path looks like udunits2/2.2.27.6/udunits2_combined.xml
+    version_path_pattern = re.compile(r'udunits2/v?(\d+(?:\.\d+)+)/{}$'.format(re.escape(combined_xml_file_name)))
+    for asset in search_response.json().get('items') or []:
+        match = version_path_pattern.match(asset.get('path', '').lstrip('/'))
+        if match:
+            return match.group(1)
+
+    return None
+
 
 def should_update_nexus(latest_version):
     r"""Check to see if latest version is already published is nexus.
@@ -238,10 +434,50 @@ def should_update_nexus(latest_version):
     False
 
     """
-    update = False
+    latest_version_no_v = latest_version.replace('v', '')
+
+    # a HEAD request tells us if the current combined xml exists, and when it
+    # was last modified, without downloading it
+    logging.debug('Check for the current combined xml.')
+    head_response = SESSION.head(current_combined_xml_url, allow_redirects=True)
+    if head_response.status_code == 404:
+        # current xml file does not exists on nexus, so for sure create it
+        # (this is the bootstrap case)
+        logging.info('Current version does not exist on nexus server - force update.')
+        return True
+    head_response.raise_for_status()
+
+    # if the current combined xml has not changed since the last run, the
+    # version used to build it has not changed either
+    last_modified = head_response.headers.get('Last-Modified')
+    cache = _load_cache(nexus_current_cache_file_name)
+    if last_modified and cache.get('last_modified') == last_modified and cache.get('version'):
+        udunits2_version_nexus = cache['version']
+        logging.info('UDUNITS-2 release version used to build current nexus version (cached): {}'.format(
+            udunits2_version_nexus))
+        return latest_version_no_v != udunits2_version_nexus
+
+    def cache_version(version):
+        if last_modified:
+            _save_cache(nexus_current_cache_file_name, {'last_modified': last_modified, 'version': version})
+
+    logging.debug('Search nexus for the version of the current combined xml.')
+    current_checksum = get_nexus_current_checksum()
+    if current_checksum:
+        udunits2_version_nexus = get_nexus_version_from_checksum(current_checksum)
+        if not udunits2_version_nexus:
+            # "current" was published without its versioned copy (e.g. a
+            # partially failed run), so publish both again
+            logging.info('Current version on nexus has no matching versioned copy - force update.')
+            return True
+        logging.info('UDUNITS-2 release version used to build current nexus version: {}'.format(udunits2_version_nexus))
+        cache_version(udunits2_version_nexus)
+        return latest_version_no_v != udunits2_version_nexus
+
     current_udunits2_combined_component_name = 'udunits2/current/udunits2_combined.xml'
 
-    logging.debug('Search and fetch current version of the combined xml from nexus.')
+    logging.debug('...current combined xml not found in search results. '
+                  'Search and fetch current version of the combined xml from nexus.')
 
     search_params = {
         'repository': repository_name,
@@ -250,45 +486,127 @@ def should_update_nexus(latest_version):
 
     # use nexus asset search and download api to get current version of combined
     # xml file
-    search_response = requests.get(nexus_asset_search_and_download_url,
-                                   params=search_params)
-
-    if search_response.status_code == 404:
-        # if status is 404, file does not exist and we should update
-        # (this is the bootstrap case)
-        logging.info('Current version does not exist on nexus server - force update.')
-        # current xml file does not exists on nexus, so for sure create it
-        update = True
-    else:
+    search_response = SESSION.get(nexus_asset_search_and_download_url,
+                                  params=search_params,
+                                  stream=True)
+
+    with search_response:
+        if search_response.status_code == 404:
+            # if status is 404, file does not exist and we should update
+            # (this is the bootstrap case)
+            logging.info('Current version does not exist on nexus server - force update.')
+            # current xml file does not exists on nexus, so for sure create it
+            return True
 
         # if request for current version of the xml as stored on nexus fails,
         # raise an error
         search_response.raise_for_status()
 
-    # if we don't need to update due to a 404, do further checks
-    if not update:
-        # read the xml
-        udunits2_nexus_xml = search_response.content
-
-        # extract the namespaces
-        namespaces = dict([node for _, node in ET.iterparse(io.BytesIO(udunits2_nexus_xml),
-                                                            events=['start-ns'])])
-        # namespace looks like:
-        # xmlns:a="https://raw.githubusercontent.com/Unidata/UDUNITS-2/v2.2.27.6/lib/udunits2-accepted.xml"
-        # so by splitting on /, we can get the version string from element 5
-        # this is kind of lame, but if the format of the url changes, then the script will break before any
-        # new artifact is published
-        udunits2_version_nexus = namespaces.get('a').split('/')[5]
-        # but, in an attempt to validate that this is a version number of sorts...
-        if len(udunits2_version_nexus.split('.')) < 2:
-            raise ValueError(
-                'nexus version {} does not appear to be an actual version number. exiting.'.format(
-                    udunits2_version_nexus))
-        # check if version strings match. If not, need an update
-        logging.info('UDUNITS-2 release version used to build current nexus version: {}'.format(udunits2_version_nexus))
-        update = latest_version != udunits2_version_nexus
+        # extract the namespaces. These are all declared on the root element,
+        # so stop reading the xml from the network once the root element starts
+        search_response.raw.decode_content = True
+        namespaces = {}
+        for event, node in ET.iterparse(search_response.raw, events=['start-ns', 'start']):
+            if event == 'start':
+                break
+            prefix, uri = node
+            namespaces[prefix] = uri
+
+    # namespace looks like:
+    # xmlns:a="https://raw.githubusercontent.com/Unidata/UDUNITS-2/v2.2.27.6/lib/udunits2-accepted.xml"
+    # so by splitting on /, we can get the version string from element 5
+    # this is kind of lame, but if the format of the url changes, then the script will break before any
+    # new artifact is published
+    udunits2_version_nexus = namespaces.get('a').split('/')[5]
+    # but, in an attempt to validate that this is a version number of sorts...
+    if len(udunits2_version_nexus.split('.')) < 2:
+        raise ValueError(
+            'nexus version {} does not appear to be an actual version number. exiting.'.format(
+                udunits2_version_nexus))
+    # check if version strings match. If not, need an update
+    logging.info('UDUNITS-2 release version used to build current nexus version: {}'.format(udunits2_version_nexus))
+    cache_version(udunits2_version_nexus.replace('v', ''))
+    return latest_version != udunits2_version_nexus
+
+
+async def _fetch_all(urls):
+    r"""Concurrently fetch the content of several urls.
+
+    Parameters
+    ----------
+    urls : list of string
+       urls to fetch
+
+    Returns
+    -------
+    dict
+        body of each response (bytes), keyed by url
+
+    """
+    semaphore = asyncio.Semaphore(max_concurrent_fetches)
+
+    async def fetch(session, url):
+        async with semaphore:
+            async with session.get(url) as response:
+                response.raise_for_status()
+                return await response.read()
+
+    async with aiohttp.ClientSession() as session:
+        bodies = await asyncio.gather(*(fetch(session, url) for url in urls))
+
+    return dict(zip(urls, bodies))
+
 
-    return update
+def _parse_unit_system(system_xml, namespace_uri):
+    r"""Stream parse a unit system xml document, collecting <unit> and <prefix> elements.
+
+    The tag of each collected element (and all of its children) is put into
+    the given namespace as it is parsed. Any other top level elements are
+    discarded.
+
+    Parameters
+    ----------
+    system_xml : bytes
+       content of the unit system xml file
+    namespace_uri : string
+       namespace to use for the tags of the collected elements
+
+    Returns
+    -------
+    dict
+        lists of the collected elements, keyed by 'unit' and 'prefix'
+
+    """
+    found_elements = {'unit': [], 'prefix': []}
+    # namespaced tag names, so the new tag string is built once per unique tag
+    # rather than once per element
+    tag_cache = {}
+    # the standard library parser drops comments and processing instructions,
+    # so do the same with lxml to keep them out of the combined xml
+    parser_options = {'remove_comments': True, 'remove_pis': True} if using_lxml else {}
+    depth = 0
+    for event, element in ET.iterparse(io.BytesIO(system_xml), events=('start', 'end'), **parser_options):
+        if event == 'start':
+            depth += 1
+            continue
+
+        depth -= 1
+        # only interested in direct children of the root element
+        if depth != 1:
+            continue
+
+        if element.tag in found_elements:
+            found_elements[element.tag].append(element)
+            for child in element.iter():
+                tag = child.tag
+                namespaced_tag = tag_cache.get(tag)
+                if namespaced_tag is None:
+                    namespaced_tag = tag_cache[tag] = '{{{}}}{}'.format(namespace_uri, tag)
+                child.tag = namespaced_tag
+        else:
+            element.clear()
+
+    return found_elements
 
 
 def update_nexus(version):
@@ -322,33 +640,38 @@ def update_nexus(version):
     udunits2_prefix = 'u2'
     udunits2_uri = 'https://doi.org/10.5065/D6KD1WN0'
 
-    namespaces = {}
+    namespaces = {udunits2_prefix: udunits2_uri}
 
+    # resource urls are built by appending file names to this, so it must end with /
     udunits_resource_base_url = 'https://raw.githubusercontent.com/Unidata/UDUNITS-2/{}/lib/'.format(version)
 
-    response = requests.get(urllib.parse.urljoin(udunits_resource_base_url, 'udunits2.xml'))
+    response = SESSION.get('{}udunits2.xml'.format(udunits_resource_base_url))
     udunits2_xml = response.content
     udunits2_registry = ET.fromstring(udunits2_xml)
 
-    udunits2_unit_systems = udunits2_registry.findall('import')
+    # (prefix, url, filename) of each unit system, in the order they are
+    # imported by udunits2.xml
+    plan = [(prefix_map[system_doc_element.text],
+             '{}{}'.format(udunits_resource_base_url, system_doc_element.text),
+             system_doc_element.text)
+            for system_doc_element in udunits2_registry.findall('import')]
+    namespaces.update({prefix: url for prefix, url, _ in plan})
+
+    # fetch all of the unit system files at once, but parse them one at a time
+    logging.info('Fetching {} unit system files.'.format(len(plan)))
+    system_xmls = asyncio.run(_fetch_all([url for _, url, _ in plan]))
 
     all_elements = []
-    for system_doc_element in udunits2_unit_systems:
-        system_filename = system_doc_element.text
+    for _, url, system_filename in plan:
         logging.info('Processing info from {}.'.format(system_filename))
-        prefix = prefix_map[system_filename]
-        url = urllib.parse.urljoin(udunits_resource_base_url, system_filename)
-        namespaces[prefix] = url
-        response = requests.get(url)
-        system_xml = response.content
-        system = ET.fromstring(system_xml)
+        found_elements = _parse_unit_system(system_xmls[url], url)
         logging.debug('...looking for <unit> elements')
-        elements_to_add = system.findall('unit')
+        elements_to_add = found_elements['unit']
         if len(elements_to_add) > 0:
             logging.debug('...found {} <unit> elements.'.format(len(elements_to_add)))
         else:
             logging.debug('...no <unit> elements found. Looking for <prefix> elements.')
-            elements_to_add = system.findall('prefix')
+            elements_to_add = found_elements['prefix']
             if len(elements_to_add) > 0:
                 logging.debug('...found {} <prefix> elements.'.format(len(elements_to_add)))
             else:
@@ -356,25 +679,24 @@ def update_nexus(version):
                 logging.error(msg)
                 raise ValueError(msg)
 
-        logging.debug('...adding namespace prefix to all {} found elements'.format(len(elements_to_add)))
-        for element in elements_to_add:
-            for child in element.iter():
-                child.tag = '{}:{}'.format(prefix, child.tag)
-
         logging.info('...processed {} entries.'.format(len(elements_to_add)))
         all_elements.extend(elements_to_add)
 
     logging.info('Construct combined xml document.')
-    combined_systems = ET.Element('udunits-2')
+    # declare all of the namespaces on the root element. Tags are in
+    # {uri}local form, and are written out using these prefixes.
+    logging.debug('...adding namespaces')
+    if using_lxml:
+        combined_systems = ET.Element('udunits-2', nsmap=namespaces)
+    else:
+        for prefix, url in namespaces.items():
+            ET.register_namespace(prefix, url)
+        combined_systems = ET.Element('udunits-2')
 
     combined_root = ET.ElementTree(combined_systems)
-    logging.debug('...adding namespaces')
-    combined_root.getroot().set('xmlns:{}'.format(udunits2_prefix), udunits2_uri)
-    for prefix, url in namespaces.items():
-        combined_root.getroot().set('xmlns:{}'.format(prefix), url)
 
     logging.debug('...adding unit systems')
-    unit_systems = ET.Element('{}:unit-system'.format(udunits2_prefix))
+    unit_systems = ET.Element('{{{}}}unit-system'.format(udunits2_uri))
     for element in all_elements:
         unit_systems.append(element)
 
@@ -386,7 +708,10 @@ def update_nexus(version):
     combined_root.getroot().insert(0, combined_file_copyright)
 
     logging.info('Write combined xml document to disk.')
-    combined_root.write(combined_xml_file_name, encoding="UTF-8", xml_declaration=True)
+    # serialize the whole document in memory, then write it out in one go
+    combined_xml = ET.tostring(combined_root.getroot(), encoding="UTF-8", xml_declaration=True)
+    with open(combined_xml_file_name, 'wb') as f:
+        f.write(combined_xml)
 
     logging.info('\nSuccess! Publish combined xml document to nexus.\n')
     publish_to_nexus(version_no_v, combined_xml_file_name, copyright_file_name)
@@ -407,20 +732,23 @@ if __name__ == "__main__":
     """
     logging.info('=+=+=+=+=+=')
     logging.info('Begin update process.')
-    # get latest version info from github
-    udunits2_version_gh = get_latest_github_release_version()
-
-    # check latest version from nexus, and see if the string differs from what we got from github
-    if should_update_nexus(udunits2_version_gh):
-        # create new combined xml based on new release
-        update_nexus(udunits2_version_gh)
-        # cleanup like good citizens
-        if os.path.exists(copyright_file_name) and os.path.exists(combined_xml_file_name):
-            logging.info('Cleanup temporary files.')
-            os.remove(copyright_file_name)
-            os.remove(combined_xml_file_name)
-        logging.info('Finished update. Exiting.')
-    else:
-        logging.info('No new version of udunits-2 detected. Exiting.')
+    try:
+        # get latest version info from github
+        udunits2_version_gh = get_latest_github_release_version()
+
+        # check latest version from nexus, and see if the string differs from what we got from github
+        if should_update_nexus(udunits2_version_gh):
+            # create new combined xml based on new release
+            update_nexus(udunits2_version_gh)
+            # cleanup like good citizens
+            if os.path.exists(copyright_file_name) and os.path.exists(combined_xml_file_name):
+                logging.info('Cleanup temporary files.')
+                os.remove(copyright_file_name)
+                os.remove(combined_xml_file_name)
+            logging.info('Finished update. Exiting.')
+        else:
+            logging.info('No new version of udunits-2 detected. Exiting.')
+    finally:
+        SESSION.close()
 
     logging.info('=+=+=+=+=+=')